@@ -3,8 +3,9 @@ RattleCache by Marcel Kohl: https://github.com/mkohl98
 
 
 The module provides a Cache class that allows you to create cache instances with different eviction modes such as LRU
-(Least Recently Used), LRA (Least Recently Added), and LFU (Least Frequently Used). It supports features like setting a
-memory limit for the cache, serialization of data, and efficient eviction of entries when the memory limit is reached.
+(Least Recently Used), LRA (Least Recently Added), LFU (Least Frequently Used) and WTinyLFU (Window TinyLFU). It supports
+features like setting a memory limit for the cache, serialization of data, and efficient eviction of entries when the
+memory limit is reached.
 
 The Cache class provides methods for adding, retrieving, updating, and deleting entries from the cache. It also allows
 you to get an overview of all identifiers in the cache and their corresponding data size. Additionally, you can
@@ -13,43 +14,242 @@ calculate the memory usage and usage percentage of the cache.
 The module includes three decorator functions: cached and cached_args and cached_dependency. These decorators can be
 used to cache the results of function or method calls using the Cache instance. The cached decorator caches the result
 based on a unique identifier, while the cached_dependency decorator caches the result based on a
-specific dependency value. The cached_args decorator uses a combination of the function name and the provided arguments
+specific dependency value. The cached_args decorator uses a combination of the function and the provided arguments
 to generate an identifier to cache the returned data.
 """
 
 
 ### Dependencies
 
-from collections import OrderedDict, defaultdict
+from array import array
+from collections import deque
 import pickle
 import sys
 import functools
 import heapq
 import threading
+import types
+import weakref
+
+try:
+    import msgpack  # optional, only used by Cache instances with serializer="msgpack"
+except ImportError:
+    msgpack = None
 
 
 ### Constants
 
 MAX_SHARED_CACHE_MEMORY: int = None
 """int, Constant to set if you want to set a maximum shared memory [megabyte] of all Cache class instances."""
-_SHARED_CASHES: list = []
-"""list, protected constant, stores all instances of Cache class"""
+_SHARED_CASHES: weakref.WeakSet = weakref.WeakSet()
+"""WeakSet, protected constant, stores all living instances of Cache class"""
+_SHARED_MEMORY: int = 0
+"""int, protected constant, summed memory limit [megabyte] of all living Cache instances"""
+_SHARED_LOCK: threading.Lock = threading.Lock()
+"""Lock, protected constant, guards _SHARED_CASHES and _SHARED_MEMORY"""
+_IDENTIFIER_TYPES: frozenset = frozenset((str, int, float, bool))
+"""frozenset, protected constant, argument types used by cached_args to generate identifiers"""
+_IDENTIFIER_BASES: tuple = (str, int, float)
+"""tuple, protected constant, base types of subclassed arguments used by cached_args to generate identifiers"""
+_NO_KWARGS: frozenset = frozenset()
+"""frozenset, protected constant, shared keyword part of cached_args identifiers for calls without kwargs"""
+_MISSING: object = object()
+"""object, protected constant, sentinel the decorators pass to Cache.get as default to detect cache misses"""
+_FLAT_TYPES: frozenset = frozenset((str, bytes, bytearray, int, float, complex, bool, type(None), range))
+"""frozenset, protected constant, types whose size is fully reported by sys.getsizeof"""
+_NOT_MEASURED_TYPES: tuple = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType)
+"""tuple, protected constant, shared objects that are referenced by but not owned by cached data"""
+_SKETCH_SEEDS: tuple = (0x97CB3127, 0xB492B66F, 0x9AE16A3B, 0xCBF29CE4)
+"""tuple, protected constant, seeds for the four hash functions of the WTinyLFU frequency sketch"""
+_SKETCH_HALVE: bytes = bytes((byte >> 1) & 0x77 for byte in range(256))
+"""bytes, protected constant, translation table halving both 4-bit counters packed into a byte"""
+_MSGPACK_TYPES: frozenset = frozenset((str, bytes, int, float, bool, type(None)))
+"""frozenset, protected constant, types besides dict and list that msgpack restores unchanged"""
+_SLOT_NAMES: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+"""WeakKeyDictionary, protected constant, slot attribute names per type, does not keep the types alive"""
+
+
+### Helper Classes
+
+class _FrequencySketch:
+    """
+    Count-Min sketch with 4-bit counters estimating how often an identifier was accessed, used by the WTinyLFU mode
+    to decide on admission. All counters are halved after a sample of increments, so the estimate follows recent
+    accesses instead of the all-time frequency.
+    """
+    __slots__ = ("table", "width", "additions", "sample_size")
+
+    def __init__(self, width: int = 1024):
+        self.width = 1 << (max(width, 2) - 1).bit_length()  # power of two to map hashes with a bit mask
+        self.table = array("B", bytes(2 * self.width))  # 4 rows of width counters, two counters per byte
+        self.additions = 0
+        self.sample_size = 10 * self.width
+
+    def __counters(self, identifier) -> list:
+        """ Returns the index of the counter of identifier in each of the 4 rows. """
+        hash_value = hash(identifier)
+        mask = self.width - 1
+        counters = []
+        for row, seed in enumerate(_SKETCH_SEEDS):
+            mixed = ((hash_value ^ seed) * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+            counters.append(row * self.width + ((mixed ^ (mixed >> 32)) & mask))
+        return counters
+
+    def estimate(self, identifier) -> int:
+        """ Returns the estimated access frequency of identifier. """
+        table = self.table
+        return min((table[counter >> 1] >> ((counter & 1) << 2)) & 15 for counter in self.__counters(identifier))
+
+    def increment(self, identifier):
+        """ Increments the counters of identifier, saturating at 15, and ages all counters after a full sample. """
+        table = self.table
+        incremented = False
+        for counter in self.__counters(identifier):
+            shift = (counter & 1) << 2
+            if (table[counter >> 1] >> shift) & 15 < 15:
+                table[counter >> 1] += 1 << shift
+                incremented = True
+        if incremented:
+            self.additions += 1
+            if self.additions >= self.sample_size:
+                self.table = array("B", self.table.tobytes().translate(_SKETCH_HALVE))
+                self.additions //= 2
+
+
+class _FrequencyBucket:
+    """
+    Node of the doubly-linked list of frequencies used by the LFU mode. Holds all identifiers accessed exactly frequency
+    times, ordered from least recently used, so entries with equal frequency are evicted oldest first.
+    """
+    __slots__ = ("frequency", "keys", "prev", "next")
+
+    def __init__(self, frequency: int):
+        self.frequency = frequency
+        self.keys = {}  # identifiers of the bucket, values are unused
+        self.prev = self.next = self
+
+
+class _Serialized:
+    """
+    Wrapper for serialized cache entries. Keeps serialized entries distinguishable from user data of type bytes,
+    holds the out-of-band buffers of pickle protocol 5 and the deserialized data once the entry was retrieved. The
+    payload and buffers are released once the entry is deserialized.
+    """
+    __slots__ = ("payload", "buffers", "serializer", "data", "size")
+
+    def __init__(self, payload: bytes, buffers: list, serializer):
+        self.payload = payload
+        self.buffers = buffers
+        self.serializer = serializer
+        self.data = _MISSING
+        self.size = len(payload) + sum(memoryview(buffer).nbytes for buffer in buffers)
+
+    def __sizeof__(self) -> int:
+        """ Returns the size of the payload and all out-of-band buffers in bytes. """
+        return self.size
+
+
+class _Shard:
+    """
+    Independent part of a Cache instance with its own entries, memory accounting, eviction bookkeeping and lock, so
+    operations on identifiers of different shards do not contend for the same lock.
+    """
+    __slots__ = (
+        "cache", "sizes", "bytes_used", "limit_bytes", "lock", "buckets", "frequency_head",
+        "sketch", "window", "probation", "protected", "window_bytes", "protected_bytes",
+    )
+
+    def __init__(self, limit_bytes, mode: str):
+        self.cache = {}  # dicts keep insertion order, oldest entries come first
+        self.sizes = {}  # Measured size in bytes of every cached entry
+        self.bytes_used = 0
+        self.limit_bytes = limit_bytes
+        self.lock = threading.RLock()
+
+        # LFU mode only data
+        self.buckets = {}  # Frequency bucket of every cached entry
+        self.frequency_head = _FrequencyBucket(0)  # Head of the circular list of buckets, ordered by frequency
+
+        # WTinyLFU mode only data, the segments map identifiers to their size and are ordered from least recently used
+        self.sketch = _FrequencySketch() if mode == "WTinyLFU" else None
+        self.window = {}  # Admission window for new entries
+        self.probation = {}  # Main segment for entries admitted from the window
+        self.protected = {}  # Main segment for entries used again while on probation
+        self.window_bytes = 0
+        self.protected_bytes = 0
+
+
+### Helper Functions
+
+def _release_shared_memory(memory_limit: int):
+    """ Removes the memory limit of a garbage collected Cache instance from the shared memory total. """
+    global _SHARED_MEMORY
+    with _SHARED_LOCK:
+        _SHARED_MEMORY -= memory_limit
+
+
+def _slot_names(obj_type: type) -> tuple:
+    """ Returns the attribute names of all slots declared by obj_type and its base classes. """
+    names = _SLOT_NAMES.get(obj_type)
+    if names is not None:
+        return names
+    names = []
+    for cls in obj_type.__mro__:
+        slots = cls.__dict__.get("__slots__", ())
+        if isinstance(slots, str):
+            slots = (slots,)
+        for name in slots:
+            if name in ("__dict__", "__weakref__"):
+                continue
+            # private names are stored mangled with the name of the declaring class
+            if name.startswith("__") and not name.endswith("__"):
+                name = "_" + cls.__name__.lstrip("_") + name
+            names.append(name)
+    names = tuple(names)
+    _SLOT_NAMES[obj_type] = names
+    return names
+
+
+def _msgpack_restores(data) -> bool:
+    """
+    Returns True if msgpack restores data unchanged, i.e. data only consists of dicts, lists and _MSGPACK_TYPES.
+    Tuples, bytearrays and subclasses would be unpacked as lists, bytes and their base types.
+    """
+    stack = [data]
+    while stack:
+        obj = stack.pop()
+        obj_type = type(obj)
+        if obj_type is dict:
+            for key in obj:
+                if type(key) not in _MSGPACK_TYPES:
+                    return False
+            stack.extend(obj.values())
+        elif obj_type is list:
+            stack.extend(obj)
+        elif obj_type not in _MSGPACK_TYPES:
+            return False
+    return True
 
 
 ### Main Class
 
 class Cache:
     """
-    Cache class that allows you to create cache instances with different eviction modes such as LRU
-    (Least Recently Used), LRA (Least Recently Added), and LFU (Least Frequently Used). It supports features like
-    setting a memory limit for the cache, serialization of data, and efficient eviction of entries when the memory
+    Cache class that allows you to create cache instances with different eviction modes such as LRU (Least Recently
+    Used), LRA (Least Recently Added), LFU (Least Frequently Used) and WTinyLFU (Window TinyLFU). It supports features
+    like setting a memory limit for the cache, serialization of data, and efficient eviction of entries when the memory
     limit is reached.
 
     Attributes (read-only after instance construction):
         memory_limit (int): The memory limit in megabytes for the cache instance.
-        mode (str): The eviction mode for the cache (LRU, LRA, or LFU).
-        eviction_percentage (float): The eviction percentage to determine when to start evicting entries.
+        mode (str): The eviction mode for the cache (LRU, LRA, LFU or WTinyLFU).
+        eviction_percentage (float): The share of the memory limit the cache is reduced to once eviction starts.
         serialize_limit: The limit in megabytes for automatically serializing large data entries.
+        serializer: The serializer for serialized entries, "pickle5", "msgpack" or any object providing
+            dumps(data) -> bytes and loads(bytes) like the pickle module (e.g. cloudpickle). "msgpack" requires the
+            msgpack package and falls back to "pickle5" for data msgpack can not handle.
+        shards (int): The number of independently locked shards the cache is split into. Each shard holds an equal
+            share of the memory limit and evicts on its own, so eviction order is only kept within a shard.
 
     Methods:
         has(identifier: str) -> bool:
@@ -58,8 +258,8 @@ class Cache:
         add(identifier: str, data, serialize: bool = False):
             Adds an entry to the cache.
 
-        get(identifier: str):
-            Retrieves an entry from the cache.
+        get(identifier: str, default=None):
+            Retrieves an entry from the cache, or default if it does not exist.
 
         update(identifier: str, data, serialize: bool = False):
             Updates data in cache, cached by identifier.
@@ -70,8 +270,8 @@ class Cache:
         clear_cache():
             Clears the cache.
 
-        get_overview() -> str:
-            Returns an overview of all identifiers and their data size.
+        get_overview(top: int = None):
+            Prints an overview of all (or the top largest) identifiers and their data size.
 
         get_memory_usage() -> float:
             Returns the used cache memory in megabytes.
@@ -82,44 +282,80 @@ class Cache:
         identifiers() -> list:
             Returns a list with all identifiers.
     """
+    __slots__ = (
+        "_Cache__memory_limit", "_Cache__mode", "_Cache__eviction_percentage", "_Cache__serialize_limit",
+        "_Cache__serialize_limit_bytes", "_Cache__serializer", "_Cache__shards",
+        "_Cache__on_add", "_Cache__lookup", "_Cache__on_remove", "_Cache__on_update", "_Cache__evict_to",
+        "__weakref__",
+    )
+
     def __init__(self,
                  memory_limit: int,
                  mode: str = "LRU",
                  eviction_percentage: float = 0.9,
                  serialize_limit=None,
+                 serializer="pickle5",
+                 shards: int = 1,
                  ):
 
-        if mode not in ("LRU", "LRA", "LFU"):
+        if mode not in ("LRU", "LRA", "LFU", "WTinyLFU"):
             raise AttributeError(f"'{mode}' is not a valid eviction mode")
+        if isinstance(serializer, str):
+            if serializer not in ("pickle5", "msgpack"):
+                raise AttributeError(f"'{serializer}' is not a valid serializer")
+        elif not (callable(getattr(serializer, "dumps", None)) and callable(getattr(serializer, "loads", None))):
+            raise AttributeError(f"'{serializer}' is not a valid serializer, it needs a dumps and loads function")
+        if serializer == "msgpack" and msgpack is None:
+            serializer = "pickle5"
+        if type(shards) != int or shards < 1:
+            raise ValueError("shards has to be a positive int.")
 
         self.__memory_limit = memory_limit
         self.__mode = mode
         self.__eviction_percentage = eviction_percentage
         self.__serialize_limit = serialize_limit
-        self.__cache = OrderedDict()
-        self.__lock = threading.Lock()
-
-        # LFU mode only data
-        if self.__mode == "LFU":
-            self.__frequency = defaultdict(int)  # Track the frequency of cache entries
-            self.__frequency_heap = []  # Heap to keep track of entries based on their frequency
-
-        # show that you exceed max_memory_shared
-        _SHARED_CASHES.append(self)
-        if MAX_SHARED_CACHE_MEMORY is not None:
-            if type(MAX_SHARED_CACHE_MEMORY) != int:
-                raise TypeError("MAX_SHARED_CACHE_MEMORY has to be either None or int.")
-            check_sum = 0
-            for cache in _SHARED_CASHES:
-                check_sum += cache.memory_limit
-            if check_sum > MAX_SHARED_CACHE_MEMORY:
-                print("\x1b[31;20mCacheWarning: "
-                      "Most recent initialized instance of Cache class exceeds your set MAX_SHARED_CACHE_MEMORY.\n"
-                      "This Cache instance will be deleted. "
-                      "Check all your instances or adjust MAX_SHARED_CACHE_MEMORY only once at the "
-                      "start of your application.\x1b[0m"
-                      )
-                del self
+        self.__serializer = serializer
+        self.__serialize_limit_bytes = None if serialize_limit is None else serialize_limit * 1024 * 1024
+
+        # memory accounting, kept in bytes per shard and updated incrementally on every insert and removal
+        shard_limit_bytes = None if memory_limit is None else memory_limit * 1024 * 1024 // shards
+        self.__shards = tuple(_Shard(shard_limit_bytes, mode) for _ in range(shards))
+
+        # bind the eviction mode specific bookkeeping once instead of branching on the mode in every call
+        if mode == "LRU":
+            self.__on_add, self.__lookup, self.__on_remove = self.__skip, self.__lookup_lru, self.__skip
+            self.__on_update = self.__move_to_end
+            self.__evict_to = self.__evict_oldest
+        elif mode == "LRA":
+            # retrievals do not change anything in LRA mode, so get skips the hook and the lock altogether
+            self.__on_add, self.__lookup, self.__on_remove = self.__skip, None, self.__skip
+            self.__on_update = self.__move_to_end
+            self.__evict_to = self.__evict_oldest
+        elif mode == "LFU":
+            self.__on_add, self.__lookup = self.__increment_frequency, self.__lookup_lfu
+            self.__on_remove = self.__forget_frequency
+            self.__on_update = self.__increment_frequency
+            self.__evict_to = self.__evict_least_frequent
+        else:
+            self.__on_add, self.__lookup, self.__on_remove = \
+                self.__admit_to_window, self.__lookup_tiny_lfu, self.__leave_segment
+            self.__on_update = self.__record_access
+            self.__evict_to = self.__evict_tiny_lfu
+
+        # refuse instances that exceed max_memory_shared, the running total avoids summing up all instances
+        if MAX_SHARED_CACHE_MEMORY is not None and type(MAX_SHARED_CACHE_MEMORY) != int:
+            raise TypeError("MAX_SHARED_CACHE_MEMORY has to be either None or int.")
+        global _SHARED_MEMORY
+        shared_memory = memory_limit or 0
+        with _SHARED_LOCK:
+            if MAX_SHARED_CACHE_MEMORY is not None and _SHARED_MEMORY + shared_memory > MAX_SHARED_CACHE_MEMORY:
+                raise MemoryError(
+                    "This Cache instance exceeds your set MAX_SHARED_CACHE_MEMORY. Check all your instances or "
+                    "adjust MAX_SHARED_CACHE_MEMORY only once at the start of your application."
+                )
+            _SHARED_MEMORY += shared_memory
+            _SHARED_CASHES.add(self)
+        weakref.finalize(self, _release_shared_memory, shared_memory)
 
     # attributes and properties
     @property
@@ -138,6 +374,14 @@ class Cache:
     def serialize_limit(self):
         return self.__serialize_limit
 
+    @property
+    def serializer(self):
+        return self.__serializer
+
+    @property
+    def shards(self) -> int:
+        return len(self.__shards)
+
     # private methods
     def __getitem__(self, identifier: str):
         return self.get(identifier)
@@ -146,53 +390,316 @@ class Cache:
         # this does not update!!!
         self.add(identifier, data)
 
+    def __serialize_data(self, data) -> _Serialized:
+        """ Serializes data using a custom serializer or msgpack if selected and possible, otherwise pickle 5. """
+        if not isinstance(self.__serializer, str):
+            return _Serialized(self.__serializer.dumps(data), [], self.__serializer)
+        if self.__serializer == "msgpack" and _msgpack_restores(data):
+            try:
+                return _Serialized(msgpack.packb(data, use_bin_type=True), [], "msgpack")
+            except (TypeError, ValueError, OverflowError):
+                pass
+        # large buffers (e.g. bytearray, numpy arrays) are kept out-of-band to avoid copying them into the payload
+        buffers = []
+        payload = pickle.dumps(data, protocol=5, buffer_callback=buffers.append)
+        return _Serialized(payload, buffers, "pickle5")
+
+    @staticmethod
+    def __deserialize_data(serializer, payload: bytes, buffers: list):
+        """  Deserializes data using the serializer it was serialized with. """
+        if serializer == "pickle5":
+            return pickle.loads(payload, buffers=buffers)
+        if serializer == "msgpack":
+            # dict keys may be of any type msgpack can pack, not only str
+            return msgpack.unpackb(payload, raw=False, strict_map_key=False)
+        return serializer.loads(payload)
+
+    def __get_bytes_used(self) -> int:
+        """ Returns the used cache memory in bytes, summed from the counters of all shards. """
+        if len(self.__shards) == 1:
+            return self.__shards[0].bytes_used
+        return sum([shard.bytes_used for shard in self.__shards])
+
+    def __get_shard(self, identifier) -> _Shard:
+        """ Returns the shard responsible for identifier. """
+        shards = self.__shards
+        if len(shards) == 1:
+            return shards[0]
+        return shards[hash(identifier) % len(shards)]
+
+    @staticmethod
+    def __store_entry(shard: _Shard, identifier, data, data_size: int):
+        """ Stores data under identifier and books its size. Shard lock has to be held by the caller. """
+        shard.cache[identifier] = data
+        shard.sizes[identifier] = data_size
+        shard.bytes_used += data_size
+
+    @staticmethod
+    def __resize_entry(shard: _Shard, identifier, data_size: int):
+        """ Books a new size for an existing entry. Shard lock has to be held by the caller. """
+        size_delta = data_size - shard.sizes[identifier]
+        shard.sizes[identifier] = data_size
+        shard.bytes_used += size_delta
+        # the WTinyLFU segments keep the sizes of their entries, they are empty in all other modes
+        if identifier in shard.window:
+            shard.window_bytes += size_delta
+            shard.window[identifier] = data_size
+        elif identifier in shard.protected:
+            shard.protected_bytes += size_delta
+            shard.protected[identifier] = data_size
+        elif identifier in shard.probation:
+            shard.probation[identifier] = data_size
+
+    def __remove_entry(self, shard: _Shard, identifier):
+        """ Removes identifier from the shard and releases its size. Shard lock has to be held by the caller. """
+        del shard.cache[identifier]
+        shard.bytes_used -= shard.sizes.pop(identifier)
+        self.__on_remove(shard, identifier)
+
+    # eviction mode specific bookkeeping, bound to the instance in __init__. Shard lock has to be held by the caller.
+    @staticmethod
+    def __skip(shard: _Shard, identifier):
+        """ Bookkeeping of eviction modes that do not track this kind of operation. """
+
+    @staticmethod
+    def __move_to_end(shard: _Shard, identifier):
+        """ LRU, LRA: Re-inserts an updated entry to move it to the end of the insertion order. """
+        shard.cache[identifier] = shard.cache.pop(identifier)
+
+    @staticmethod
+    def __lookup_lru(shard: _Shard, identifier):
+        """ LRU: Returns the entry or _MISSING, a found entry is re-inserted to move it to the end. """
+        cache = shard.cache
+        data = cache.pop(identifier, _MISSING)
+        if data is not _MISSING:
+            cache[identifier] = data
+        return data
+
     @staticmethod
-    def __serialize_data(data):
-        """ Serializes data using pickle """
-        return pickle.dumps(data)
+    def __evict_oldest(shard: _Shard, target_bytes: int, keep=_MISSING):
+        """
+        LRU, LRA: Evicts entries of the shard in one pass until at most target_bytes are used. The entry keep was just
+        updated or deserialized and is not evicted.
+        """
+        # the cache is ordered from least recently added/used to most recently added/used, keep may be anywhere in LRA
+        cache, sizes = shard.cache, shard.sizes
+        excess_bytes = shard.bytes_used - target_bytes
+        victims = []
+        for key in cache:
+            if excess_bytes <= 0:
+                break
+            if key == keep:
+                continue
+            victims.append(key)
+            excess_bytes -= sizes[key]
+        for key in victims:
+            del cache[key]
+            shard.bytes_used -= sizes.pop(key)
 
     @staticmethod
-    def __deserialize_data(serialized_data):
-        """  Deserializes data using pickle. """
-        return pickle.loads(serialized_data)
-
-    def __evict_entry(self):
-        """  Evicts the least recently used entry from the cache. """
-        with self.__lock:
-            if self.__mode == "LRA":
-                key = self.__get_least_key()
-                del self.__cache[key]
-            elif self.__mode == "LRU":
-                key = self.__get_least_key()
-                del self.__cache[key]
-            elif self.__mode == "LFU":
-                # Evict the least frequently used entry
-                while self.__frequency_heap:
-                    frequency, key = heapq.heappop(self.__frequency_heap)
-                    if key in self.__cache:
-                        del self.__cache[key]
+    def __unlink_bucket(shard: _Shard, bucket: _FrequencyBucket):
+        """ LFU: Removes a bucket from the list of buckets once it has no identifiers left. """
+        if not bucket.keys and bucket is not shard.frequency_head:
+            bucket.prev.next = bucket.next
+            bucket.next.prev = bucket.prev
+
+    @classmethod
+    def __increment_frequency(cls, shard: _Shard, identifier):
+        """ LFU: Increase frequency of item by identifier, moving it to the bucket of the next frequency. """
+        bucket = shard.buckets.get(identifier)
+        if bucket is None:
+            bucket = shard.frequency_head
+        else:
+            del bucket.keys[identifier]
+
+        frequency = bucket.frequency + 1
+        next_bucket = bucket.next
+        if next_bucket.frequency != frequency:
+            # the head has frequency 0, so the end of the list never matches
+            next_bucket = _FrequencyBucket(frequency)
+            next_bucket.prev, next_bucket.next = bucket, bucket.next
+            bucket.next.prev = next_bucket
+            bucket.next = next_bucket
+        next_bucket.keys[identifier] = None
+        shard.buckets[identifier] = next_bucket
+        cls.__unlink_bucket(shard, bucket)
+
+    @classmethod
+    def __lookup_lfu(cls, shard: _Shard, identifier):
+        """ LFU: Returns the entry or _MISSING, the frequency of a found entry is increased. """
+        data = shard.cache.get(identifier, _MISSING)
+        if data is not _MISSING:
+            cls.__increment_frequency(shard, identifier)
+        return data
+
+    @classmethod
+    def __forget_frequency(cls, shard: _Shard, identifier):
+        """ LFU: Drops the frequency of a removed entry. """
+        bucket = shard.buckets.pop(identifier)
+        del bucket.keys[identifier]
+        cls.__unlink_bucket(shard, bucket)
+
+    def __evict_least_frequent(self, shard: _Shard, target_bytes: int, keep=_MISSING):
+        """
+        LFU: Evicts the least frequently used entries of the shard until at most target_bytes are used. The entry keep
+        was just updated and is not evicted.
+        """
+        head = shard.frequency_head
+        while head.next is not head and shard.bytes_used > target_bytes:
+            # the first bucket has the lowest frequency, its first identifier was used least recently
+            bucket = head.next
+            keys = iter(bucket.keys)
+            key = next(keys)
+            if key == keep:
+                key = next(keys, _MISSING)
+                if key is _MISSING:
+                    # keep is the only entry of the first bucket
+                    if bucket.next is head:
                         break
+                    key = next(iter(bucket.next.keys))
+            self.__remove_entry(shard, key)
 
-    def __get_least_key(self) -> str:
-        """ Returns the least recently used key in the cache without need to create iter but just view. """
-        return next(iter(self.__cache))
+    @staticmethod
+    def __admit_to_window(shard: _Shard, identifier):
+        """ WTinyLFU: Adds a new entry to the window and moves the window's overflow onto probation. """
+        if shard.sketch.width < len(shard.cache):
+            shard.sketch = _FrequencySketch(2 * len(shard.cache))
+        shard.sketch.increment(identifier)
+        data_size = shard.sizes[identifier]
+        shard.window[identifier] = data_size
+        shard.window_bytes += data_size
+        if shard.limit_bytes is None:
+            return
+        window_limit = shard.limit_bytes // 100
+        while len(shard.window) > 1 and shard.window_bytes > window_limit:
+            key = next(iter(shard.window))
+            size = shard.window.pop(key)
+            shard.window_bytes -= size
+            shard.probation[key] = size
+
+    @staticmethod
+    def __record_access(shard: _Shard, identifier):
+        """ WTinyLFU: Moves an accessed entry to the end of its segment, promoting it if it is on probation. """
+        shard.sketch.increment(identifier)
+        if identifier in shard.window:
+            shard.window[identifier] = shard.window.pop(identifier)
+        elif identifier in shard.protected:
+            shard.protected[identifier] = shard.protected.pop(identifier)
+        else:
+            size = shard.probation.pop(identifier)
+            shard.protected[identifier] = size
+            shard.protected_bytes += size
+            if shard.limit_bytes is None:
+                return
+            # the protected segment may use 80 % of the main region, its oldest entries are moved back onto probation
+            protected_limit = (shard.limit_bytes - shard.limit_bytes // 100) * 4 // 5
+            while len(shard.protected) > 1 and shard.protected_bytes > protected_limit:
+                key = next(iter(shard.protected))
+                size = shard.protected.pop(key)
+                shard.protected_bytes -= size
+                shard.probation[key] = size
+
+    @classmethod
+    def __lookup_tiny_lfu(cls, shard: _Shard, identifier):
+        """ WTinyLFU: Returns the entry or _MISSING, the access of a found entry is recorded. """
+        data = shard.cache.get(identifier, _MISSING)
+        if data is not _MISSING:
+            cls.__record_access(shard, identifier)
+        return data
+
+    @staticmethod
+    def __leave_segment(shard: _Shard, identifier):
+        """ WTinyLFU: Removes a removed entry from its segment. """
+        if identifier in shard.window:
+            shard.window_bytes -= shard.window.pop(identifier)
+        elif identifier in shard.protected:
+            shard.protected_bytes -= shard.protected.pop(identifier)
+        else:
+            del shard.probation[identifier]
+
+    def __evict_tiny_lfu(self, shard: _Shard, target_bytes: int, keep=_MISSING):
+        """
+        WTinyLFU: Evicts entries of the shard until at most target_bytes are used. The entry keep was just updated
+        and is not evicted.
+        """
+        while shard.cache and shard.bytes_used > target_bytes:
+            victim = self.__select_victim(shard, keep)
+            if victim is _MISSING:
+                break
+            self.__remove_entry(shard, victim)
 
     @staticmethod
-    def __get_data_size(data) -> float:
-        """ Returns the current size of data in megabytes. """
-        return sys.getsizeof(data) / (1024 * 1024)
+    def __select_victim(shard: _Shard, keep=_MISSING):
+        """
+        WTinyLFU: Returns the identifier to evict next, or _MISSING if only keep is left. The youngest entry on
+        probation (the latest one admitted from the window) only stays if it is estimated to be used more frequently
+        than the oldest one on probation.
+        """
+        probation = shard.probation
+        if len(probation) > 1 and keep not in probation:
+            victim = next(iter(probation))
+            candidate = next(reversed(probation))
+            if shard.sketch.estimate(candidate) > shard.sketch.estimate(victim):
+                return victim
+            return candidate
+        for segment in (probation, shard.protected, shard.window, shard.cache):
+            for key in segment:
+                if key != keep:
+                    return key
+        return _MISSING
 
-    def __update_frequency(self, identifier):
-        """ Increase frequency of item by identifier"""
-        if self.__mode == "LFU":
-            with self.__lock:
-                self.__frequency[identifier] += 1
+    @staticmethod
+    def __get_data_size(data) -> int:
+        """
+        Returns the current size of data in bytes, including all objects referenced by containers and instances.
+        Objects referenced multiple times are counted once. Instances referenced by the attributes of another instance
+        are counted without their attributes, as they are usually shared objects like loggers or connections.
+        """
+        data_type = type(data)
+        if data_type in _FLAT_TYPES or data_type is _Serialized:
+            return sys.getsizeof(data)
+
+        size = 0
+        seen = set()
+        stack = [data]
+        # objects reached through instance attributes, walked after stack so objects in both are not descended into
+        nested = []
+        while stack or nested:
+            top_level = bool(stack)
+            obj = stack.pop() if top_level else nested.pop()
+            if id(obj) in seen or isinstance(obj, _NOT_MEASURED_TYPES):
+                continue
+            seen.add(id(obj))
+            size += sys.getsizeof(obj)
+            obj_type = type(obj)
+            if obj_type in _FLAT_TYPES:
+                continue
+            pending = stack if top_level else nested
+            if isinstance(obj, memoryview):
+                size += obj.nbytes
+            elif isinstance(obj, dict):
+                pending.extend(obj.keys())
+                pending.extend(obj.values())
+            elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+                pending.extend(obj)
+            elif top_level:
+                # attributes of class instances
+                if hasattr(obj, "__dict__"):
+                    nested.append(obj.__dict__)
+                for slot in _slot_names(obj_type):
+                    value = getattr(obj, slot, _MISSING)
+                    if value is not _MISSING:
+                        nested.append(value)
+        return size
 
     # public methods
     def has(self, identifier: str) -> bool:
-        """ Checks if an identifier exists in the cache. """
-        with self.__lock:
-            return identifier in self.__cache
+        """
+        Checks if an identifier exists in the cache. The check does not lock the cache, so the entry may be evicted by
+        another thread right after it. Use get with a default to check and retrieve in one step.
+        """
+        # a dict membership test is atomic under the GIL
+        return identifier in self.__get_shard(identifier).cache
 
     def add(self, identifier: str, data, serialize: bool = False, update: bool = False):
         """
@@ -200,71 +707,122 @@ class Cache:
         Bracket notation is also available: **my_cache_instance[identifier] = data** (This uses serialization only if
         serialization_limit is set.)
         """
-        # skip if already existing
-        with self.__lock:
-            if identifier in self.__cache:
-                if update:
-                    self.update(identifier, data, serialize=serialize)
-                return
+        shard = self.__get_shard(identifier)
+        # skip measuring and serializing for existing entries, the check is repeated under the lock
+        if not update and identifier in shard.cache:
+            return
 
-        # eviction if needed
-        if self.__memory_limit is not None:
+        # serialization and measuring do not touch the cache, so they run outside the lock
+        if not serialize:
             data_size = self.__get_data_size(data)
-            with self.__lock:
-                while (self.__get_data_size(self.__cache) + data_size) > self.__memory_limit:
-                    self.__evict_entry()
-        # serialization
-        if self.__serialize_limit is not None and self.__get_data_size(data) > self.__serialize_limit:
-            serialize = True
+            serialize = self.__serialize_limit_bytes is not None and data_size > self.__serialize_limit_bytes
         if serialize:
+            # the serialized data has a different size than the original data
             data = self.__serialize_data(data)
-        # mode specifics
-        if self.__mode == "LFU":
-            self.__update_frequency(identifier)  # already thread locked
-        # set data
-        with self.__lock:
-            self.__cache[identifier] = data
-
-    def get(self, identifier: str):
+            data_size = self.__get_data_size(data)
+
+        with shard.lock:
+            # skip if already existing
+            if identifier in shard.cache:
+                if not update:
+                    return
+                # replace in place, this keeps the entry's eviction bookkeeping
+                shard.cache[identifier] = data
+                self.__resize_entry(shard, identifier, data_size)
+                self.__on_update(shard, identifier)
+                # evict other entries down to the eviction percentage of the limit if the entry grew past the limit
+                if shard.limit_bytes is not None and shard.bytes_used > shard.limit_bytes:
+                    self.__evict_to(shard, int(shard.limit_bytes * self.__eviction_percentage), identifier)
+                return
+            # evict down to the eviction percentage of the limit once the limit would be exceeded
+            if shard.limit_bytes is not None and shard.bytes_used + data_size > shard.limit_bytes:
+                self.__evict_to(shard, int(shard.limit_bytes * self.__eviction_percentage) - data_size)
+            # set data
+            self.__store_entry(shard, identifier, data, data_size)
+            # mode specifics
+            self.__on_add(shard, identifier)
+
+    def get(self, identifier: str, default=None):
         """
-        Retrieves an entry from the cache.
+        Retrieves an entry from the cache. Returns default if the identifier does not exist in the cache.
         Bracket notation is also available: **data = my_cache_instance[identifier]**.
         """
-        with self.__lock:
-            if identifier not in self.__cache:
-                return None
-            data = self.__cache[identifier]
-
-            # eviction mode management
-            if self.__mode == "LRU":
-                self.__cache.move_to_end(identifier)
-            if self.__mode == "LFU":
-                self.__update_frequency(identifier)
-
-        if isinstance(data, bytes):
-            return pickle.loads(data)
+        shard = self.__get_shard(identifier)
+        lookup = self.__lookup
+        # a stored None is distinguished from a miss by the _MISSING sentinel
+        if lookup is None:
+            # a single dict lookup is atomic under the GIL
+            data = shard.cache.get(identifier, _MISSING)
+        else:
+            with shard.lock:
+                # lookup and eviction mode management
+                data = lookup(shard, identifier)
+        if data is _MISSING:
+            return default
+
+        if type(data) is _Serialized:
+            if data.data is _MISSING:
+                self.__keep_deserialized(shard, identifier, data)
+            return data.data
         return data
 
+    def __keep_deserialized(self, shard: _Shard, identifier, serialized_data: _Serialized):
+        """
+        Deserializes a serialized entry once and keeps the result in place of the serialized data, so following
+        retrievals do not deserialize again. The size of the entry becomes the size of the deserialized data, other
+        entries are evicted if the shard exceeds its limit afterwards.
+        """
+        with shard.lock:
+            if serialized_data.data is not _MISSING:
+                return  # deserialized by another thread in the meantime
+            payload, buffers = serialized_data.payload, serialized_data.buffers
+
+        # deserializing and measuring do not touch the cache, so they run outside the lock
+        deserialized_data = self.__deserialize_data(serialized_data.serializer, payload, buffers)
+        data_size = self.__get_data_size(deserialized_data)
+        with shard.lock:
+            if serialized_data.data is not _MISSING:
+                return  # deserialized by another thread in the meantime
+            serialized_data.data = deserialized_data
+            serialized_data.payload, serialized_data.buffers, serialized_data.size = None, [], 0
+            if shard.cache.get(identifier) is not serialized_data:
+                return  # removed or replaced in the meantime
+            self.__resize_entry(shard, identifier, data_size)
+            if shard.limit_bytes is not None and shard.bytes_used > shard.limit_bytes:
+                self.__evict_to(shard, int(shard.limit_bytes * self.__eviction_percentage), identifier)
+
     def update(self, identifier: str, data, serialize: bool = False):
-        """ Update data in cache, cached by identifier. """
-        self.delete(identifier)  # already thread-save
-        self.add(identifier, data, serialize=serialize)  # already thread-safe
+        """ Update data in cache, cached by identifier. Adds the entry if it does not exist yet. """
+        # add replaces the entry in place in one locked step, but serializes outside the lock
+        self.add(identifier, data, serialize=serialize, update=True)
 
     def delete(self, identifier: str):
         """ Deletes an entry from the cache. """
-        with self.__lock:
-            if identifier in self.__cache:
-                del self.__cache[identifier]
+        shard = self.__get_shard(identifier)
+        with shard.lock:
+            if identifier in shard.cache:
+                self.__remove_entry(shard, identifier)
 
     def clear_cache(self) -> None:
         """ Clears cache. """
-        self.__cache = OrderedDict()
-        if self.__mode == "LFU":
-            self.__frequency = defaultdict(int)
-            self.__frequency_heap = []
-
-    def get_overview(self) -> None:
-        """ Prints an overview of all identifiers and their data size. """
+        for shard in self.__shards:
+            with shard.lock:
+                # clearing in place keeps the existing objects instead of allocating new ones
+                shard.cache.clear()
+                shard.sizes.clear()
+                shard.bytes_used = 0
+                shard.buckets.clear()
+                shard.frequency_head.prev = shard.frequency_head.next = shard.frequency_head
+                shard.window.clear()
+                shard.probation.clear()
+                shard.protected.clear()
+                shard.window_bytes = shard.protected_bytes = 0
+
+    def get_overview(self, top: int = None) -> None:
+        """
+        Prints an overview of all identifiers and their data size, sorted decreasingly by data size. If top is set,
+        only the top largest entries are listed.
+        """
         overview = [
             "Cache Overview",
             f"Memory Limit: {self.__memory_limit} mb",
@@ -273,37 +831,48 @@ class Cache:
             "Identifier\tData Type\tMemory (MB)"
         ]
 
-        # sort data increasingly by memory space occupied
-        sorted_entries = sorted(
-            self.__cache.items(),
-            key=lambda entry: self.__get_data_size(entry[1]),
-            reverse=True
-        )
+        entries = []
+        for shard in self.__shards:
+            with shard.lock:
+                entries.extend(shard.sizes.items())
 
-        for identifier, data in sorted_entries:
-            data_type = type(data).__name__
-            data_size = self.__get_data_size(data)
-            overview.append(f"{identifier}\t{data_type}\t{data_size:.2f}")
+        # sort data decreasingly by the memory space measured on insert
+        if top is None:
+            entries.sort(key=lambda entry: entry[1], reverse=True)
+        else:
+            entries = heapq.nlargest(top, entries, key=lambda entry: entry[1])
+
+        for identifier, data_size in entries:
+            shard = self.__get_shard(identifier)
+            data = shard.cache.get(identifier)
+            data_type = "serialized" if type(data) is _Serialized else type(data).__name__
+            overview.append(f"{identifier}\t{data_type}\t{data_size / (1024 * 1024):.2f}")
 
         print("\n".join(overview))
 
     def get_memory_usage(self) -> float:
         """ Returns the used cache memory in mb. """
-        total_size = sum(sys.getsizeof(value) for value in self.__cache.values())
-        return total_size / (1024 * 1024)  # Convert to megabytes
+        return self.__get_bytes_used() / (1024 * 1024)  # Convert to megabytes
 
     def get_memory_usage_percentage(self) -> float:
         """ Returns the currently used memory in percent. """
-        if self.__memory_limit > 0:
-            used_memory = self.get_memory_usage()
-            return (used_memory / self.__memory_limit) * 100
+        if self.__memory_limit is not None and self.__memory_limit > 0:
+            return self.__get_bytes_used() * 100 / (self.__memory_limit * 1024 * 1024)
         else:
             return 0.0
 
     def identifiers(self) -> list:
         """ Returns a list with all identifiers. """
-        with self.__lock:
-            return list(self.__cache.keys())
+        identifiers = []
+        for shard in self.__shards:
+            # copying the keys is atomic under the GIL, the lock is only a fallback if the dict changes meanwhile
+            try:
+                keys = list(shard.cache)
+            except RuntimeError:
+                with shard.lock:
+                    keys = list(shard.cache)
+            identifiers.extend(keys)
+        return identifiers
 
 
 ### Decorator Functions
@@ -326,6 +895,13 @@ def cached(cache: Cache, identifier: str, *args_cache, **kwargs_cache):
     if not isinstance(cache, Cache):
         raise ValueError("The 'cache' argument must be an instance of the Cache class.")
 
+    # an interned identifier is compared by its pointer in the dict lookup of each call
+    if type(identifier) is str:
+        identifier = sys.intern(identifier)
+
+    # bound methods are looked up once instead of on every call
+    cache_get, cache_add, cache_update = cache.get, cache.add, cache.update
+
     def decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
@@ -334,17 +910,19 @@ def cached(cache: Cache, identifier: str, *args_cache, **kwargs_cache):
             update_cache = kwargs.pop('update_cache', False)
 
             # get cached data if existing
-            if cache.has(identifier) and not update_cache:
-                return cache.get(identifier)
+            if not update_cache:
+                result = cache_get(identifier, _MISSING)
+                if result is not _MISSING:
+                    return result
 
             # compute data if not existing or updatable
             result = func(*args, **kwargs)
 
             # how to proceed with data
             if not update_cache:
-                cache.add(identifier, result, *args_cache, **kwargs_cache)
+                cache_add(identifier, result, *args_cache, **kwargs_cache)
             if update_cache:
-                cache.update(identifier, result)  # Call the cache_update method
+                cache_update(identifier, result)  # Call the cache_update method
 
             return result
         return wrapper
@@ -367,30 +945,44 @@ def cached_args(cache, *args_cache, **kwargs_cache):
     Returns:
         The decorator function.
     """
-    def decorator(func):
+    # bound methods are looked up once instead of on every call
+    cache_get, cache_add, cache_update = cache.get, cache.add, cache.update
 
+    def decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
             # remove update statement befor generating identifier
             update_cache = kwargs.pop('update_cache', False)
 
-            # generate identifier from args and kwargs
-            serialized_args = [arg for arg in args if isinstance(arg, (str, int, float))]
-            serialized_kwargs = {key: value for key, value in kwargs.items() if isinstance(value, (str, int, float))}
-            identifier = (func.__name__, tuple(serialized_args), frozenset(serialized_kwargs.items()))
+            # generate identifier from args and kwargs, direct type lookups are cheaper than isinstance chains, which
+            # are only needed for subclasses such as IntEnum
+            serialized_args = tuple([
+                arg for arg in args if type(arg) in _IDENTIFIER_TYPES or isinstance(arg, _IDENTIFIER_BASES)
+            ])
+            if kwargs:
+                serialized_kwargs = frozenset([
+                    (key, value) for key, value in kwargs.items()
+                    if type(value) in _IDENTIFIER_TYPES or isinstance(value, _IDENTIFIER_BASES)
+                ])
+            else:
+                serialized_kwargs = _NO_KWARGS
+            # functions hash and compare by identity, so functions of the same name do not share results
+            identifier = (func, serialized_args, serialized_kwargs)
 
             # check from function call if cache should be updated or just get data
-            if cache.has(identifier) and not update_cache:
-                return cache.get(identifier)
+            if not update_cache:
+                result = cache_get(identifier, _MISSING)
+                if result is not _MISSING:
+                    return result
 
             # compute actual result
             result = func(*args, **kwargs)
 
             # add or update cache
             if not update_cache:
-                cache.add(identifier, result, *args_cache, **kwargs_cache)
+                cache_add(identifier, result, *args_cache, **kwargs_cache)
             else:
-                cache.update(identifier, result, *args_cache, **kwargs_cache)
+                cache_update(identifier, result, *args_cache, **kwargs_cache)
 
             return result
         return wrapper
@@ -415,26 +1007,35 @@ def cached_dependency(cache: Cache, dependency_func, *args_cache, **kwargs_cache
     if not isinstance(cache, Cache):
         raise ValueError("The 'cache' argument must be an instance of the Cache class.")
 
+    # bound methods are looked up once instead of on every call
+    cache_get, cache_add, cache_update = cache.get, cache.add, cache.update
+
     def decorator(func):
+        # the prefix is built once instead of on every call
+        prefix = func.__name__ + ":"
+
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
+            # check if cache should be updated on call
+            update_cache = kwargs.pop('update_cache', False)
+
             # compute identifier from dependency
             dependency_value = dependency_func(*args, **kwargs)
-            identifier = f"{func.__name__}:{dependency_value}"
+            identifier = prefix + str(dependency_value)
 
-            # check if cache should be updated on call
-            update_cache = kwargs.pop('update_cache', False)
-            if cache.has(identifier) and not update_cache:
-                return cache.get(identifier)
+            if not update_cache:
+                result = cache_get(identifier, _MISSING)
+                if result is not _MISSING:
+                    return result
 
             # compute result of function
             result = func(*args, **kwargs)
 
             # add or update
             if not update_cache:
-                cache.add(identifier, result, *args_cache, **kwargs_cache)
+                cache_add(identifier, result, *args_cache, **kwargs_cache)
             else:
-                cache.update(identifier, result, *args_cache, **kwargs_cache)
+                cache_update(identifier, result, *args_cache, **kwargs_cache)
 
             return result
         return wrapper
@@ -1,5 +1,12 @@
+import contextlib
+import enum
+import gc
+import io
+import json
 import unittest
+import weakref
 from datetime import datetime
+import RattleCache
 from RattleCache import Cache, cached, cached_args, cached_dependency
 
 
@@ -14,17 +21,84 @@ class CacheModuleTest(unittest.TestCase):
         self.cache.add("key1", "value1")
         self.assertEqual(self.cache.get("key1"), "value1")
 
+    def test_get_default(self):
+        # Test that a missing key returns the default while a cached None is returned as it is
+        self.cache.add("key1", None)
+        self.assertIsNone(self.cache.get("key1", "default"))
+        self.assertEqual(self.cache.get("key2", "default"), "default")
+
     def test_add_with_memory_limit(self):
         # Test adding a key-value pair to the cache with serialization and retrieving the value
         self.cache.add("key1", "value1", serialize=True)
         self.assertEqual(self.cache.get("key1"), "value1")
 
+    def test_add_bytes(self):
+        # Test that bytes added without serialization are returned unchanged and serialized buffers round-trip
+        self.cache.add("key1", b"value1")
+        self.assertEqual(self.cache.get("key1"), b"value1")
+        self.cache.add("key2", bytearray(b"value2"), serialize=True)
+        self.assertEqual(self.cache.get("key2"), bytearray(b"value2"))
+
+    def test_serialized_entry_deserialized_once(self):
+        # Test that a serialized entry is deserialized on the first retrieval only and its size is booked
+        self.cache.add("key1", list(range(1000)), serialize=True)
+        data = self.cache.get("key1")
+        self.assertEqual(data, list(range(1000)))
+        self.assertIs(self.cache.get("key1"), data)
+        # the serialized data is released, only the deserialized data is booked
+        cache = Cache(memory_limit=10)
+        cache.add("key1", list(range(1000)))
+        self.assertEqual(self.cache.get_memory_usage(), cache.get_memory_usage())
+
+    def test_deserialized_entries_memory_limit(self):
+        # Test that deserializing entries on retrieval evicts other entries instead of exceeding the memory limit
+        for mode in ("LRU", "LRA", "LFU", "WTinyLFU"):
+            # the serialized entry is the oldest one, so it is not last in the eviction order after retrieving it
+            cache = Cache(memory_limit=1, mode=mode)
+            cache.add("key0", list(range(10000)), serialize=True)
+            for i in range(1, 9):
+                cache.add(f"key{i}", bytes(100 * 1024))
+            self.assertEqual(cache.get("key0"), list(range(10000)))
+            self.assertLessEqual(cache.get_memory_usage(), cache.memory_limit)
+            self.assertIn("key0", cache.identifiers())
+            self.assertLess(len(cache.identifiers()), 9)
+
+    def test_custom_serializer(self):
+        # Test that a custom serializer with dumps and loads functions is used for serialized entries
+        cache = Cache(memory_limit=10, serializer=json)
+        cache.add("key1", {"a": [1, 2]}, serialize=True)
+        self.assertEqual(cache.get("key1"), {"a": [1, 2]})
+        with self.assertRaises(AttributeError):
+            Cache(memory_limit=10, serializer="yaml")
+
+    @unittest.skipIf(RattleCache.msgpack is None, "msgpack is not installed")
+    def test_msgpack_serializer(self):
+        # Test that msgpack entries are restored unchanged, falling back to pickle for data msgpack changes
+        cache = Cache(memory_limit=10, serializer="msgpack")
+        cache.add("key1", {1: "a", "b": [{2.5: None}]}, serialize=True)
+        self.assertEqual(cache.get("key1"), {1: "a", "b": [{2.5: None}]})
+        cache.add("key2", {"a": {(1, 2): "b"}}, serialize=True)
+        self.assertEqual(cache.get("key2"), {"a": {(1, 2): "b"}})
+        cache.add("key3", {"a": (1, 2), "b": bytearray(b"xy")}, serialize=True)
+        data = cache.get("key3")
+        self.assertEqual(data, {"a": (1, 2), "b": bytearray(b"xy")})
+        self.assertIs(type(data["a"]), tuple)
+        self.assertIs(type(data["b"]), bytearray)
+
     def test_update(self):
         # Test updating the value of a key in the cache
         self.cache.add("key1", "value1")
         self.cache.update("key1", "updated_value")
         self.assertEqual(self.cache.get("key1"), "updated_value")
 
+    def test_update_in_place(self):
+        # Test that updating an entry adjusts the memory usage and marks the entry as recently used
+        self.cache.add("key1", bytes(400 * 1024))
+        self.cache.add("key2", "value2")
+        self.cache.update("key1", bytes(200 * 1024))
+        self.assertEqual(self.cache.identifiers(), ["key2", "key1"])
+        self.assertAlmostEqual(self.cache.get_memory_usage(), 0.2, places=2)
+
     def test_delete(self):
         # Test deleting a key-value pair from the cache
         self.cache.add("key1", "value1")
@@ -37,12 +111,211 @@ class CacheModuleTest(unittest.TestCase):
         self.cache.clear_cache()
         self.assertIsNone(self.cache.get("key1"))
 
+    def test_clear_cache_reuse(self):
+        # Test that a cleared cache keeps working in every mode
+        for mode in ("LRU", "LRA", "LFU", "WTinyLFU"):
+            cache = Cache(memory_limit=1, mode=mode)
+            cache.add("key1", "value1")
+            cache.get("key1")
+            cache.clear_cache()
+            self.assertEqual(cache.get_memory_usage(), 0)
+            cache.add("key2", "value2")
+            self.assertEqual(cache.get("key2"), "value2")
+            self.assertEqual(cache.identifiers(), ["key2"])
+
     def test_identifiers(self):
         # Test retrieving the list of cache identifiers
         self.cache.add("key1", "value1")
         self.cache.add("key2", "value2")
         self.assertEqual(self.cache.identifiers(), ["key1", "key2"])
 
+    def test_get_overview(self):
+        # Test that the overview lists entries by size and labels serialized entries
+        self.cache.add("key1", "value1")
+        self.cache.add("key2", list(range(1000)), serialize=True)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.cache.get_overview()
+        rows = output.getvalue().splitlines()[-2:]
+        self.assertTrue(rows[0].startswith("key2\tserialized\t"))
+        self.assertTrue(rows[1].startswith("key1\tstr\t"))
+
+    def test_memory_usage_and_eviction(self):
+        # Test that memory usage is tracked per entry and the oldest entry is evicted once the limit is reached
+        cache = Cache(memory_limit=1)
+        cache.add("key1", bytes(400 * 1024))
+        cache.add("key2", bytes(400 * 1024))
+        self.assertAlmostEqual(cache.get_memory_usage(), 0.78, places=2)
+
+        cache.add("key3", bytes(400 * 1024))
+        self.assertEqual(cache.identifiers(), ["key2", "key3"])
+        self.assertLessEqual(cache.get_memory_usage(), cache.memory_limit)
+
+        cache.delete("key2")
+        cache.delete("key3")
+        self.assertEqual(cache.get_memory_usage(), 0)
+
+    def test_memory_usage_of_containers(self):
+        # Test that the memory usage includes the items of containers
+        self.cache.add("key1", [bytes(400 * 1024), bytes(400 * 1024)])
+        self.assertGreater(self.cache.get_memory_usage(), 0.78)
+
+        # private, single string and inherited slots of instances
+        class Base:
+            __slots__ = "data"
+
+        class Slotted(Base):
+            __slots__ = ("__private",)
+
+            def __init__(self):
+                self.data = bytes(400 * 1024)
+                self.__private = bytes(400 * 1024)
+
+        self.cache.add("key2", Slotted())
+        self.assertGreater(self.cache.get_memory_usage(), 1.56)
+
+        # measuring does not keep the class alive
+        slotted_ref = weakref.ref(Slotted)
+        self.cache.delete("key2")
+        del Base, Slotted
+        gc.collect()
+        self.assertIsNone(slotted_ref())
+
+    def test_memory_usage_of_shared_references(self):
+        # Test that objects shared by cached instances are not measured with everything they reference
+        class Holder:
+            def __init__(self, value, shared=None):
+                self.value = value
+                self.shared = shared
+
+        shared = Holder([bytes(400 * 1024), bytes(400 * 1024)])
+        self.cache.add("key1", Holder(1, shared))
+        self.cache.add("key2", [Holder(2, shared), Holder(3, shared)])
+        self.assertLess(self.cache.get_memory_usage(), 0.01)
+        # instances at the top level of an entry are still measured with their attributes
+        self.cache.add("key3", shared)
+        self.assertGreater(self.cache.get_memory_usage(), 0.78)
+
+    def test_lru_and_lra_order(self):
+        # Test that retrieving an entry marks it as recently used in LRU mode but not in LRA mode
+        cache_lru = Cache(memory_limit=10, mode="LRU")
+        cache_lra = Cache(memory_limit=10, mode="LRA")
+        for cache in (cache_lru, cache_lra):
+            cache.add("key1", "value1")
+            cache.add("key2", "value2")
+            cache.get("key1")
+        self.assertEqual(cache_lru.identifiers(), ["key2", "key1"])
+        self.assertEqual(cache_lra.identifiers(), ["key1", "key2"])
+
+    def test_eviction_percentage(self):
+        # Test that eviction frees memory down to the eviction percentage of the memory limit
+        cache = Cache(memory_limit=1, eviction_percentage=0.5)
+        for i in range(6):
+            cache.add(f"key{i}", bytes(200 * 1024))
+        self.assertEqual(cache.identifiers(), ["key4", "key5"])
+
+    def test_lfu_add_and_get(self):
+        # Test that adding and retrieving in LFU mode does not block on the cache lock
+        cache = Cache(memory_limit=10, mode="LFU")
+        cache.add("key1", "value1")
+        self.assertEqual(cache.get("key1"), "value1")
+
+    def test_lfu_update_keeps_frequency(self):
+        # Test that updating an entry in LFU mode keeps its frequency instead of resetting it
+        cache = Cache(memory_limit=1, mode="LFU")
+        cache.add("key1", "x" * 400 * 1024)
+        cache.get("key1")
+        cache.add("key2", "x" * 400 * 1024)
+        cache.update("key1", "y" * 400 * 1024)
+        cache.add("key3", "x" * 400 * 1024)
+        self.assertEqual(cache.identifiers(), ["key1", "key3"])
+        self.assertEqual(cache.get("key1"), "y" * 400 * 1024)
+
+        # an update that needs eviction keeps the frequency as well
+        cache = Cache(memory_limit=1, mode="LFU")
+        cache.add("key1", "x" * 300 * 1024)
+        for _ in range(5):
+            cache.get("key1")
+        cache.add("key2", "x" * 300 * 1024)
+        cache.add("key3", "x" * 300 * 1024)
+        for _ in range(3):
+            cache.get("key3")
+        cache.update("key1", "y" * 500 * 1024)
+        self.assertEqual(cache.identifiers(), ["key1", "key3"])
+        cache.add("key4", "x" * 300 * 1024)
+        self.assertEqual(cache.identifiers(), ["key1", "key4"])
+        self.assertEqual(cache.get("key1"), "y" * 500 * 1024)
+
+    def test_lfu_eviction(self):
+        # Test that the least frequently used entry is evicted first in LFU mode
+        cache = Cache(memory_limit=1, mode="LFU")
+        cache.add("key1", "x" * 400 * 1024)
+        cache.add("key2", "x" * 400 * 1024)
+        cache.get("key1")
+        cache.add("key3", "x" * 400 * 1024)
+        self.assertEqual(cache.identifiers(), ["key1", "key3"])
+
+    def test_lfu_eviction_order(self):
+        # Test that entries of equal frequency are evicted least recently used first in LFU mode
+        cache = Cache(memory_limit=1, mode="LFU", eviction_percentage=0.6)
+        for i in range(4):
+            cache.add(f"key{i}", "x" * 200 * 1024)
+        cache.get("key0")
+        cache.get("key1")
+        cache.get("key0")
+        cache.get("key2")
+        cache.delete("key3")
+        cache.add("key3", "x" * 200 * 1024)
+        cache.add("key4", "x" * 200 * 1024)
+        cache.add("key5", "x" * 200 * 1024)
+        self.assertEqual(cache.identifiers(), ["key0", "key2", "key5"])
+
+    def test_wtinylfu_scan_resistance(self):
+        # Test that frequently used entries survive a scan of entries used only once in WTinyLFU mode
+        cache = Cache(memory_limit=1, mode="WTinyLFU")
+        for i in range(10):
+            cache.add(f"hot{i}", bytes(20 * 1024))
+        for _ in range(5):
+            for i in range(10):
+                cache.get(f"hot{i}")
+        for i in range(200):
+            cache.add(f"scan{i}", bytes(20 * 1024))
+            cache.get(f"scan{i}")
+        self.assertTrue(all(cache.has(f"hot{i}") for i in range(10)))
+
+        cache.update("hot0", "value1")
+        cache.delete("hot1")
+        self.assertEqual(cache.get("hot0"), "value1")
+        self.assertLessEqual(cache.get_memory_usage(), cache.memory_limit)
+
+    def test_shards(self):
+        # Test that a sharded cache stores, evicts and lists entries across all shards
+        cache = Cache(memory_limit=4, shards=4)
+        for i in range(20):
+            cache.add(f"key{i}", bytes(400 * 1024))
+        self.assertEqual(cache.get("key19"), bytes(400 * 1024))
+        self.assertLessEqual(cache.get_memory_usage(), cache.memory_limit)
+        self.assertLess(len(cache.identifiers()), 20)
+
+        cache.clear_cache()
+        self.assertEqual(cache.identifiers(), [])
+        self.assertEqual(cache.get_memory_usage(), 0)
+
+    def test_max_shared_cache_memory(self):
+        # Test that instances exceeding the shared memory limit are refused until other instances are released
+        RattleCache.MAX_SHARED_CACHE_MEMORY = 100
+        try:
+            del self.cache
+            gc.collect()
+            cache = Cache(memory_limit=60)
+            with self.assertRaises(MemoryError):
+                Cache(memory_limit=60)
+            del cache
+            gc.collect()
+            Cache(memory_limit=60)
+        finally:
+            RattleCache.MAX_SHARED_CACHE_MEMORY = None
+
     def test_cached_decorator(self):
         # Test the `cached` decorator with a function that has no arguments
         @cached(self.cache, "func1")
@@ -69,6 +342,51 @@ class CacheModuleTest(unittest.TestCase):
         # Check that the cached values are different for different arguments
         self.assertNotEqual(result1, result3)
 
+    def test_cached_args_decorator_same_name(self):
+        # Test that functions of the same name do not share cached results
+        @cached_args(self.cache)
+        def func(a):
+            return a
+
+        func_1 = func
+
+        @cached_args(self.cache)
+        def func(a):
+            return a * 2
+
+        self.assertEqual(func_1(2), 2)
+        self.assertEqual(func(2), 4)
+
+    def test_cached_args_decorator_releases_function(self):
+        # Test that a function decorated by cached_args is not kept alive once its entries are removed
+        def make_func():
+            @cached_args(self.cache)
+            def func(a):
+                return a
+            return func
+
+        func = make_func()
+        func(1)
+        func_ref = weakref.ref(func.__wrapped__)
+        del func
+        self.cache.clear_cache()
+        gc.collect()
+        self.assertIsNone(func_ref())
+
+    def test_cached_args_decorator_subclass_args(self):
+        # Test that arguments of subclassed types are part of the identifier
+        class Color(enum.IntEnum):
+            RED = 1
+            BLUE = 2
+
+        @cached_args(self.cache)
+        def func(color, name=None):
+            return color.name, name
+
+        self.assertEqual(func(Color.RED), ("RED", None))
+        self.assertEqual(func(Color.BLUE), ("BLUE", None))
+        self.assertEqual(func(Color.RED, name=Color.BLUE), ("RED", Color.BLUE))
+
     def test_cached_dependency_decorator(self):
         # Test the `cached_dependency` decorator with a function that has a dependency function
         def dependency_func(a, b):
@@ -87,6 +405,18 @@ class CacheModuleTest(unittest.TestCase):
         # Check that the cached values are different for different arguments
         self.assertNotEqual(result1, result3)
 
+    def test_cached_decorator_none_result(self):
+        # Test that a cached None result is not recomputed
+        calls = []
+
+        @cached(self.cache, "func6")
+        def func6():
+            calls.append(1)
+
+        func6()
+        func6()
+        self.assertEqual(len(calls), 1)
+
     def test_cached_decorator_with_multiple_args(self):
         # Test the `cached` decorator with a function that has multiple arguments
         @cached(self.cache, "func4")